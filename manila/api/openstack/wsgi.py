@@ -869,9 +869,12 @@ class Resource(wsgi.Application):
         LOG.info(msg)
 
         if hasattr(response, 'headers'):
-            for hdr, val in response.headers.items():
-                val = utils.convert_str(val)
-                response.headers[hdr] = val
+            for hdr, val in list(response.headers.items()):
+                # Header values are normally native strings already; only
+                # rewrite the ones that actually needed converting.
+                converted = utils.convert_str(val)
+                if converted is not val:
+                    response.headers[hdr] = converted
             _set_request_id_header(request, response.headers)
             if not request.api_version_request.is_null():
                 response.headers[API_VERSION_REQUEST_HEADER] = (
@@ -99,9 +99,10 @@ class Scheduler(object):
         """Return the list of hosts that have a running service for topic."""
 
         services = db.service_get_all_by_topic(context, topic)
+        now = timeutils.utcnow()
         return [service['host']
                 for service in services
-                if utils.service_is_up(service)]
+                if utils.service_is_up(service, now)]
 
     def schedule(self, context, topic, method, *_args, **_kwargs):
         """Must override schedule method for scheduler to work."""
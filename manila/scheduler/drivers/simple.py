@@ -20,6 +20,7 @@ Simple Scheduler
 """
 
 from oslo_config import cfg
+from oslo_utils import timeutils
 
 from manila import db
 from manila import exception
@@ -58,12 +59,14 @@ class SimpleScheduler(chance.ChanceScheduler):
             results = [(service_g, gigs) for (service_g, gigs) in results
                        if (service_g['availability_zone_id']
                            == availability_zone_id)]
+        now = timeutils.utcnow()
         for result in results:
             (service, share_gigabytes) = result
             if share_gigabytes + share_size > CONF.max_gigabytes:
                 msg = _("Not enough allocatable share gigabytes remaining")
                 raise exception.NoValidHost(reason=msg)
-            if utils.service_is_up(service) and not service['disabled']:
+            if (utils.service_is_up(service, now) and
+                    not service['disabled']):
                 updated_share = base.share_update_db(context,
                                                      share_id,
                                                      service['host'])
@@ -641,11 +641,12 @@ class HostManager(object):
         share_services = db.service_get_all_by_topic(context, topic)
 
         active_hosts = set()
+        now = timeutils.utcnow()
         for service in share_services:
             host = service['host']
 
             # Warn about down services and remove them from host_state_map
-            if not utils.service_is_up(service) or service['disabled']:
+            if not utils.service_is_up(service, now) or service['disabled']:
                 LOG.warning("Share service is down. (host: %s).", host)
                 continue
 
@@ -65,6 +65,9 @@ class SSHPool(pools.Pool):
         self.conn_timeout = conn_timeout if conn_timeout else None
         self.path_to_private_key = privatekey
         super(SSHPool, self).__init__(*args, **kwargs)
+        # ids of the connections in free_items, so that membership checks
+        # do not have to scan the deque
+        self._free_ids = set(id(conn) for conn in self.free_items)
 
     def create(self):  # pylint: disable=method-hidden
         ssh = paramiko.SSHClient()
@@ -111,6 +114,7 @@ class SSHPool(pools.Pool):
         """
         if self.free_items:
             conn = self.free_items.popleft()
+            self._free_ids.discard(id(conn))
             if conn:
                 if conn.get_transport().is_active():
                     return conn
@@ -123,10 +127,18 @@ class SSHPool(pools.Pool):
             return created
         return self.channel.get()
 
+    def put(self, conn):
+        """Return a connection to the pool."""
+        free_count = len(self.free_items)
+        super(SSHPool, self).put(conn)
+        if len(self.free_items) > free_count:
+            self._free_ids.add(id(conn))
+
     def remove(self, ssh):
         """Close an ssh client and remove it from free_items."""
         ssh.close()
-        if ssh in self.free_items:
+        if id(ssh) in self._free_ids:
+            self._free_ids.discard(id(ssh))
             self.free_items.remove(ssh)
             if self.current_size > 0:
                 self.current_size -= 1
@@ -46,6 +46,7 @@ from manila import rpc
 from manila import service
 from manila.tests import conf_fixture
 from manila.tests import fake_notifier
+from manila import utils
 
 test_opts = [
     cfg.StrOpt('sqlite_clean_db',
@@ -232,6 +233,8 @@ class TestCase(base_test.BaseTestCase):
 
         conf_fixture.set_defaults(CONF)
         CONF([], default_config_files=[])
+        utils._reset_conf_cache(CONF, False)
+        self.addCleanup(utils._reset_conf_cache, CONF, False)
 
         global _DB_CACHE
         if not _DB_CACHE:
@@ -331,6 +334,7 @@ class TestCase(base_test.BaseTestCase):
         """Override flag variables for a test."""
         for k, v in kw.items():
             CONF.set_override(k, v)
+        utils._reset_conf_cache(CONF, False)
 
     def start_service(self, name, host=None, **kwargs):
         host = host and host or uuidutils.generate_uuid()
@@ -473,4 +477,5 @@ class TestCase(base_test.BaseTestCase):
     def override_config(self, name, override, group=None):
         """Cleanly override CONF variables."""
         CONF.set_override(name, override, group)
+        utils._reset_conf_cache(CONF, False)
         self.addCleanup(CONF.clear_override, name, group)
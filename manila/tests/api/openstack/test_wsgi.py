@@ -306,6 +306,37 @@ class ResourceTest(test.TestCase):
         self.assertEqual('off'.encode("utf-8"), response.body)
         self.assertEqual(200, response.status_int)
 
+    def test_resource_response_headers_converted(self):
+        class FakeHeaders(dict):
+            def __init__(self, *args, **kwargs):
+                super(FakeHeaders, self).__init__(*args, **kwargs)
+                self.written = []
+
+            def __setitem__(self, key, value):
+                self.written.append(key)
+                super(FakeHeaders, self).__setitem__(key, value)
+
+        str_value = 'fake_str_value'
+        headers = FakeHeaders({'X-Bytes': b'fake_bytes_value',
+                               'X-Str': str_value})
+        fake_response = mock.Mock(status_int=200, headers=headers)
+
+        class Controller(object):
+            def index(self, req):
+                return fake_response
+
+        req = wsgi.Request.blank('/tests')
+        resource = wsgi.Resource(Controller())
+
+        response = resource._process_stack(req, 'index', {}, None, '',
+                                           'application/json')
+
+        self.assertIs(fake_response, response)
+        self.assertEqual('fake_bytes_value', headers['X-Bytes'])
+        self.assertIs(str_value, headers['X-Str'])
+        self.assertIn('X-Bytes', headers.written)
+        self.assertNotIn('X-Str', headers.written)
+
     def test_resource_not_authorized(self):
         class Controller(object):
             def index(self, req):
@@ -14,6 +14,8 @@
 #    under the License.
 """Example Module A for testing utils.monkey_patch()."""
 
+from manila.tests.monkey_patch_example import example_base
+
 
 def example_function_a():
     return 'Example function'
@@ -25,3 +27,11 @@ class ExampleClassA(object):
 
     def example_method_add(self, arg1, arg2):
         return arg1 + arg2
+
+
+class ExampleClassAChild(example_base.ExampleBaseClass):
+    def example_method(self):
+        return 'Example child method'
+
+
+ExampleClassAAlias = ExampleClassA
@@ -17,9 +17,11 @@
 Tests For Simple Scheduler
 """
 
+import datetime
 from unittest import mock
 
 from oslo_config import cfg
+from oslo_utils import timeutils
 
 from manila import context
 from manila import db
@@ -65,12 +67,43 @@ class SimpleSchedulerSharesTestCase(test.TestCase):
 
         self.driver.schedule_create_share(self.context,
                                           fake_request_spec, {})
-        utils.service_is_up.assert_called_once_with(utils.IsAMatcher(dict))
+        utils.service_is_up.assert_called_once_with(
+            utils.IsAMatcher(dict), utils.IsAMatcher(datetime.datetime))
         db.service_get_all_share_sorted.assert_called_once_with(
             utils.IsAMatcher(context.RequestContext))
         base.share_update_db.assert_called_once_with(
             utils.IsAMatcher(context.RequestContext), share_id, 'fake_host1')
 
+    def test_create_share_checks_services_with_same_time(self):
+        share_id = 'fake'
+        fake_share = {'id': share_id, 'size': 1}
+        fake_service_1 = {'disabled': False, 'host': 'fake_host1'}
+        fake_service_2 = {'disabled': False, 'host': 'fake_host2'}
+        fake_result = [(fake_service_1, 1), (fake_service_2, 2)]
+        fake_request_spec = {
+            'share_id': share_id,
+            'share_properties': fake_share,
+        }
+        fake_now = datetime.datetime(2024, 1, 1)
+        self.mock_object(timeutils, 'utcnow',
+                         mock.Mock(return_value=fake_now))
+        self.mock_object(utils, 'service_is_up',
+                         mock.Mock(side_effect=[False, True]))
+        self.mock_object(db, 'service_get_all_share_sorted',
+                         mock.Mock(return_value=fake_result))
+        self.mock_object(base, 'share_update_db',
+                         mock.Mock(return_value=db_utils.create_share()))
+
+        self.driver.schedule_create_share(self.context,
+                                          fake_request_spec, {})
+
+        utils.service_is_up.assert_has_calls([
+            mock.call(fake_service_1, fake_now),
+            mock.call(fake_service_2, fake_now),
+        ])
+        base.share_update_db.assert_called_once_with(
+            utils.IsAMatcher(context.RequestContext), share_id, 'fake_host2')
+
     def test_create_share_if_services_not_available(self):
         share_id = 'fake'
         fake_share = {'id': share_id, 'size': 1}
@@ -136,7 +169,8 @@ class SimpleSchedulerSharesTestCase(test.TestCase):
 
         self.driver.schedule_create_share(self.context,
                                           fake_request_spec, {})
-        utils.service_is_up.assert_called_once_with(fake_service_1)
+        utils.service_is_up.assert_called_once_with(
+            fake_service_1, utils.IsAMatcher(datetime.datetime))
         base.share_update_db.assert_called_once_with(
             utils.IsAMatcher(context.RequestContext), share_id,
             fake_service_1['host'])
@@ -163,7 +197,8 @@ class SimpleSchedulerSharesTestCase(test.TestCase):
 
         self.driver.schedule_create_share(self.admin_context,
                                           fake_request_spec, {})
-        utils.service_is_up.assert_called_once_with(fake_service)
+        utils.service_is_up.assert_called_once_with(
+            fake_service, utils.IsAMatcher(datetime.datetime))
         db.service_get_all_share_sorted.assert_called_once_with(
             utils.IsAMatcher(context.RequestContext))
         base.share_update_db.assert_called_once_with(
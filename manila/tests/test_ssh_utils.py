@@ -166,6 +166,31 @@ class SSHPoolTestCase(test.TestCase):
         sshpool.remove(ssh_to_remove)
 
         self.assertNotIn(ssh_to_remove, list(sshpool.free_items))
+        self.assertEqual(2, sshpool.current_size)
+
+    @mock.patch('builtins.open')
+    @mock.patch('paramiko.SSHClient')
+    @mock.patch('os.path.isfile', return_value=True)
+    def test_sshpool_remove_after_put(self, mock_isfile, mock_sshclient,
+                                      mock_open):
+        mock_sshclient.side_effect = [mock.Mock(), mock.Mock()]
+        sshpool = ssh_utils.SSHPool("127.0.0.1", 22, 10,
+                                    "test", password="test",
+                                    min_size=2, max_size=2)
+
+        ssh = sshpool.get()
+        self.assertNotIn(ssh, list(sshpool.free_items))
+
+        # A connection that is checked out is not removed from the pool
+        sshpool.remove(ssh)
+        self.assertEqual(2, sshpool.current_size)
+
+        sshpool.put(ssh)
+        self.assertIn(ssh, list(sshpool.free_items))
+
+        sshpool.remove(ssh)
+        self.assertNotIn(ssh, list(sshpool.free_items))
+        self.assertEqual(1, sshpool.current_size)
 
     @mock.patch('builtins.open')
     @mock.patch('paramiko.SSHClient')
@@ -15,11 +15,15 @@
 #    under the License.
 
 import datetime
+import importlib
 import json
+import logging
+import shlex
 import time
 from unittest import mock
 
 import ddt
+from oslo_concurrency import processutils
 from oslo_config import cfg
 from oslo_utils import encodeutils
 from oslo_utils import timeutils
@@ -32,6 +36,8 @@ from manila import context
 from manila.db import api as db
 from manila import exception
 from manila import test
+from manila.tests.monkey_patch_example import example_a
+from manila.tests.monkey_patch_example import example_base
 from manila import utils
 
 CONF = cfg.CONF
@@ -72,6 +78,102 @@ class GenericUtilsTestCase(test.TestCase):
             self.assertFalse(result)
             timeutils.utcnow.assert_called_once_with()
 
+    def test_service_is_up_with_now(self):
+        fts_func = datetime.datetime.fromtimestamp
+        fake_now = 1000
+        down_time = 5
+        self.flags(service_down_time=down_time)
+        self.mock_object(timeutils, 'utcnow')
+        service = {'updated_at': fts_func(fake_now - down_time),
+                   'created_at': fts_func(fake_now - down_time)}
+
+        self.assertTrue(utils.service_is_up(service, fts_func(fake_now)))
+        self.assertFalse(
+            utils.service_is_up(service, fts_func(fake_now + 1)))
+        timeutils.utcnow.assert_not_called()
+
+    @ddt.data(True, False)
+    def test_execute(self, debug):
+        self.mock_object(processutils, 'execute')
+        self.flags(rootwrap_config='/fake/rootwrap.conf', debug=debug)
+
+        utils.execute('ls', run_as_root=True)
+
+        expected_kwargs = {
+            'root_helper': 'sudo manila-rootwrap /fake/rootwrap.conf',
+            'run_as_root': True,
+        }
+        if debug:
+            expected_kwargs['loglevel'] = logging.DEBUG
+        processutils.execute.assert_called_once_with('ls', **expected_kwargs)
+
+    def test_execute_conf_cache_reset_on_mutate(self):
+        self.mock_object(processutils, 'execute')
+        self.flags(rootwrap_config='/fake/rootwrap.conf')
+        utils.execute('ls')
+
+        # The cached value is kept until the configuration is reloaded
+        CONF.set_override('rootwrap_config', '/other/rootwrap.conf')
+        self.addCleanup(CONF.clear_override, 'rootwrap_config')
+        utils.execute('ls')
+        CONF.mutate_config_files()
+        utils.execute('ls')
+
+        self.assertEqual(
+            ['sudo manila-rootwrap /fake/rootwrap.conf',
+             'sudo manila-rootwrap /fake/rootwrap.conf',
+             'sudo manila-rootwrap /other/rootwrap.conf'],
+            [c[1]['root_helper']
+             for c in processutils.execute.call_args_list])
+
+    def test_lazy_pluggable(self):
+        self.flags(db_backend='fake_backend')
+        pluggable = utils.LazyPluggable('db_backend', fake_backend='json')
+
+        self.assertIs(json.dumps, pluggable.dumps)
+        self.assertIs(json.dumps, vars(pluggable)['dumps'])
+        self.assertIs(json.dumps, pluggable.dumps)
+
+    def test_lazy_pluggable_invalid_backend(self):
+        self.flags(db_backend='fake_backend')
+        pluggable = utils.LazyPluggable('db_backend', other='fake.module')
+
+        self.assertRaises(exception.Error, getattr, pluggable, 'fake_attr')
+
+    def test_walk_class_hierarchy(self):
+        class A(object):
+            pass
+
+        class B(A):
+            pass
+
+        class C(A):
+            pass
+
+        class D(B, C):
+            pass
+
+        self.assertEqual([D, B, C], list(utils.walk_class_hierarchy(A)))
+
+    @ddt.data(
+        (datetime.datetime(2012, 2, 14, 20, 53, 7), False,
+         '2012-02-14T20:53:07Z'),
+        (datetime.datetime(2012, 2, 14, 20, 53, 7, 123), True,
+         '2012-02-14T20:53:07.000123Z'),
+        (datetime.datetime(2012, 2, 14, 20, 53, 7, 0), True,
+         '2012-02-14T20:53:07.000000Z'),
+        (datetime.datetime(2012, 2, 14, 20, 53, 7,
+                           tzinfo=datetime.timezone.utc), False,
+         '2012-02-14T20:53:07Z'),
+    )
+    @ddt.unpack
+    def test_isotime(self, at, subsecond, expected):
+        self.assertEqual(expected, utils.isotime(at, subsecond=subsecond))
+        self.assertEqual(
+            at.strftime('%Y-%m-%dT%H:%M:%S.%f' if subsecond
+                        else '%Y-%m-%dT%H:%M:%S') + 'Z',
+            utils.isotime(at, subsecond=subsecond))
+
     @ddt.data(['ssh', '-D', 'my_name@name_of_remote_computer'],
               ['echo', '"quoted arg with space"'],
               ['echo', "'quoted arg with space'"])
@@ -87,7 +189,8 @@ class GenericUtilsTestCase(test.TestCase):
               ['echo', '"quoted argument";rm -rf'],
               ['echo', "'quoted argument `rm -rf`'"],
               ['echo', '"quoted";virus;"quoted"'],
-              ['echo', '"quoted";virus;\'quoted\''])
+              ['echo', '"quoted";virus;\'quoted\''],
+              ['cmd', 'escaped\\;virus;ls'])
     def test_check_ssh_injection_on_error0(self, cmd):
         self.assertRaises(exception.SSHInjectionThreat,
                           utils.check_ssh_injection, cmd)
@@ -152,6 +255,9 @@ class MonkeyPatchTestCase(test.TestCase):
     """Unit test for utils.monkey_patch()."""
     def setUp(self):
         super(MonkeyPatchTestCase, self).setUp()
+        # Start from unpatched example modules, patching is not undone
+        importlib.reload(example_base)
+        importlib.reload(example_a)
         self.example_package = 'manila.tests.monkey_patch_example.'
         self.flags(
             monkey_patch=True,
@@ -193,6 +299,32 @@ class MonkeyPatchTestCase(test.TestCase):
         self.assertNotIn(package_b + 'ExampleClassB.example_method_add',
                          manila.tests.monkey_patch_example.CALLED_FUNCTION)
 
+    def test_monkey_patch_inherited_and_aliased(self):
+        utils.monkey_patch()
+        manila.tests.monkey_patch_example.CALLED_FUNCTION = []
+
+        child = example_a.ExampleClassAChild()
+        self.assertEqual('Example child method', child.example_method())
+        self.assertEqual('Example inherited method',
+                         child.example_inherited_method())
+        self.assertEqual('Example static method',
+                         child.example_static_method())
+        self.assertEqual('Example static method',
+                         example_a.ExampleClassAChild.example_static_method())
+        self.assertEqual('Example method',
+                         example_a.ExampleClassAAlias().example_method())
+        # The base class lives in a module that is not patched
+        example_base.ExampleBaseClass().example_inherited_method()
+
+        package_a = self.example_package + 'example_a.'
+        self.assertEqual(
+            [package_a + 'ExampleClassAChild.example_method',
+             package_a + 'ExampleClassAChild.example_inherited_method',
+             package_a + 'ExampleClassAChild.example_static_method',
+             package_a + 'ExampleClassAChild.example_static_method',
+             package_a + 'ExampleClassA.example_method'],
+            manila.tests.monkey_patch_example.CALLED_FUNCTION)
+
 
 @ddt.ddt
 class CidrToNetmaskTestCase(test.TestCase):
@@ -248,6 +380,48 @@ class CidrToPrefixLenTestCase(test.TestCase):
                           utils.cidr_to_prefixlen, cidr)
 
 
+@ddt.ddt
+class CidrToNetworkInfoTestCase(test.TestCase):
+    """Unit test for cidr to network info."""
+
+    @ddt.data(
+        ('10.0.0.0/24', ('255.255.255.0', 24)),
+        ('fdf8:f53b:82e1::1/64', ('ffff:ffff:ffff:ffff::', 64)),
+    )
+    @ddt.unpack
+    def test_cidr_to_network_info(self, cidr, expected):
+        self.assertEqual(expected, utils.cidr_to_network_info(cidr))
+
+    def test_cidr_to_network_info_cached(self):
+        cidr = '10.0.1.0/24'
+        utils.cidr_to_network_info.cache_clear()
+        self.mock_object(utils, 'cidr_to_network',
+                         mock.Mock(wraps=utils.cidr_to_network))
+
+        self.assertEqual('255.255.255.0', utils.cidr_to_netmask(cidr))
+        self.assertEqual(24, utils.cidr_to_prefixlen(cidr))
+
+        utils.cidr_to_network.assert_called_once_with(cidr)
+
+    def test_cidr_to_network_info_invalid(self):
+        self.assertRaises(exception.InvalidInput,
+                          utils.cidr_to_network_info, '10.0.0.0/33')
+
+
+@ddt.ddt
+class CheckParamsExistTestCase(test.TestCase):
+
+    @ddt.data([], ['a'], ['a', 'b'])
+    def test_check_params_exist(self, keys):
+        self.assertIsNone(
+            utils.check_params_exist(keys, {'a': 1, 'b': 2, 'c': 3}))
+
+    @ddt.data(['d'], ['a', 'd'])
+    def test_check_params_exist_missing(self, keys):
+        self.assertRaises(exc.HTTPBadRequest, utils.check_params_exist,
+                          keys, {'a': 1, 'b': 2, 'c': 3})
+
+
 @ddt.ddt
 class ParseBoolValueTestCase(test.TestCase):
 
@@ -315,6 +489,10 @@ class IsValidIPVersion(test.TestCase):
         for vers in (6, '6'):
             self.assertTrue(utils.is_valid_ip_address(addr, vers))
 
+    @ddt.data('192.168.0.1', '2001:cdba::3257:9652')
+    def test_valid_any_version(self, addr):
+        self.assertTrue(utils.is_valid_ip_address(addr, [4, 6]))
+
     @ddt.data(
         {'addr': '1.1.1.1', 'vers': 3},
         {'addr': '1.1.1.1', 'vers': 5},
@@ -386,16 +564,33 @@ class TestComparableMixin(test.TestCase):
         self.assertTrue(self.two != self.one)
         self.assertFalse(self.one != self.one)
 
-    def test_compare(self):
-        self.assertEqual(NotImplemented,
-                         self.one._compare(1, self.one._cmpkey))
+    def test_compare_not_comparable(self):
+        for method in (self.one.__lt__, self.one.__le__, self.one.__eq__,
+                       self.one.__ge__, self.one.__gt__, self.one.__ne__):
+            self.assertEqual(NotImplemented, method(1))
+        self.assertEqual(NotImplemented, self.one.__lt__(Comparable('a')))
 
 
 class WrongException(Exception):
     pass
 
 
+@utils.retry(retry_param=WrongException, retries=2)
+def _retried_at_import(func):
+    return func()
+
+
 class TestRetryDecorator(test.TestCase):
+    def test_retry_decorated_at_import_uses_patched_sleep(self):
+        func = mock.Mock(side_effect=[WrongException, 'success'])
+
+        with mock.patch('tenacity.nap.sleep') as mock_sleep:
+            ret = _retried_at_import(func)
+
+        self.assertEqual('success', ret)
+        self.assertEqual(2, func.call_count)
+        mock_sleep.assert_called_once_with(mock.ANY)
+
     def test_no_retry_required(self):
         self.counter = 0
 
@@ -655,17 +850,37 @@ class ShareMigrationHelperTestCase(test.TestCase):
         ]
 
         self.mock_object(time, 'sleep')
+        self.mock_object(time, 'time', mock.Mock(return_value=0))
         self.mock_object(db, 'share_instance_get',
                          mock.Mock(side_effect=fake_share_instances))
 
         utils.wait_for_access_update(self.context, db,
-                                     fake_share_instances[0], 1)
+                                     fake_share_instances[0], 10)
 
         db.share_instance_get.assert_has_calls(
             [mock.call(mock.ANY, sid), mock.call(mock.ANY, sid)]
         )
         time.sleep.assert_called_once_with(1.414)
 
+    @ddt.data((100, 5.0), (3, 3))
+    @ddt.unpack
+    def test_wait_for_access_update_sleep_bounded(self, timeout,
+                                                  expected_sleep):
+        syncing = {
+            'id': 1,
+            'access_rules_status': constants.SHARE_INSTANCE_RULES_SYNCING,
+        }
+        active = dict(syncing, access_rules_status=constants.STATUS_ACTIVE)
+        self.mock_object(time, 'sleep')
+        self.mock_object(time, 'time', mock.Mock(return_value=0))
+        self.mock_object(db, 'share_instance_get',
+                         mock.Mock(side_effect=[syncing] * 10 + [active]))
+
+        utils.wait_for_access_update(self.context, db, syncing, timeout)
+
+        self.assertEqual(10, time.sleep.call_count)
+        time.sleep.assert_called_with(expected_sleep)
+
     @ddt.data(
         (
             {
@@ -756,6 +971,61 @@ class TestDisableNotifications(test.TestCase):
         result = self._decorated_method()
         self.assertEqual(utils.DO_NOTHING, result)
 
+    def test_notifications_enabled_cached(self):
+        self.assertTrue(utils.notifications_enabled(CONF))
+
+        # The cached answer is kept until the configuration is reloaded
+        CONF.set_override('driver', ['noop'],
+                          group='oslo_messaging_notifications')
+        self.addCleanup(CONF.clear_override, 'driver',
+                        group='oslo_messaging_notifications')
+        self.assertTrue(utils.notifications_enabled(CONF))
+
+        CONF.mutate_config_files()
+        self.assertFalse(utils.notifications_enabled(CONF))
+
+
+@ddt.ddt
+class WriteRemoteFileTestCase(test.TestCase):
+
+    @ddt.data((False, ''), (True, 'sudo '))
+    @ddt.unpack
+    def test_write_remote_file(self, as_root, prefix):
+        ssh = mock.Mock()
+        stdin = mock.Mock()
+        ssh.exec_command.return_value = (stdin, mock.Mock(), mock.Mock())
+
+        utils.write_remote_file(ssh, '/fake/file', 'fake contents',
+                                as_root=as_root)
+
+        ssh.exec_command.assert_called_once_with(
+            prefix + 'sh -c \'cat > /fake/file.tmp && '
+            'mv -f /fake/file.tmp /fake/file\'')
+        stdin.write.assert_called_once_with('fake contents')
+        stdin.close.assert_called_once_with()
+        stdin.channel.shutdown_write.assert_called_once_with()
+
+    @ddt.data(False, True)
+    def test_write_remote_file_quotes_filename(self, as_root):
+        ssh = mock.Mock()
+        ssh.exec_command.return_value = (mock.Mock(), mock.Mock(),
+                                         mock.Mock())
+        filename = "/fake/it's; touch /tmp/pwned"
+
+        utils.write_remote_file(ssh, filename, 'fake contents',
+                                as_root=as_root)
+
+        cmd = ssh.exec_command.call_args[0][0]
+        args = shlex.split(cmd)
+        if as_root:
+            self.assertEqual('sudo', args.pop(0))
+        self.assertEqual(['sh', '-c'], args[:2])
+        self.assertEqual(3, len(args))
+        self.assertEqual(
+            ['cat', '>', filename + '.tmp', '&&',
+             'mv', '-f', filename + '.tmp', filename],
+            shlex.split(args[2]))
+
 
 @ddt.ddt
 class TestAllTenantsValueCase(test.TestCase):
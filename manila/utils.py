@@ -20,8 +20,9 @@
 import contextlib
 import functools
 import inspect
-import pyclbr
+import ipaddress
 import re
+import shlex
 import shutil
 import sys
 import tempfile
@@ -35,7 +36,6 @@ from oslo_concurrency import processutils
 from oslo_config import cfg
 from oslo_log import log
 from oslo_utils import importutils
-from oslo_utils import netutils
 from oslo_utils import strutils
 from oslo_utils import timeutils
 from webob import exc
@@ -52,8 +52,17 @@ LOG = log.getLogger(__name__)
 if getattr(CONF, 'debug', False):
     logging.getLogger("paramiko").setLevel(logging.DEBUG)
 
-_ISO8601_TIME_FORMAT_SUBSECOND = '%Y-%m-%dT%H:%M:%S.%f'
-_ISO8601_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+_SHELL_META = frozenset('`$|;&><')
+_QUOTES = ('"', "'")
+_SSH_SPECIAL_CHARS = _SHELL_META.union(_QUOTES)
+_IP_VERSIONS = frozenset((4, 6))
+_SIZE_MULTIPLIERS = ('K', 'M', 'G', 'T', 'P')
+_SIZE_MULTIPLIER_MAP = {
+    k: 1024.0 ** v for v, k in enumerate(_SIZE_MULTIPLIERS)
+}
+_SIZE_RE = re.compile(r"^(\d*[.,]*\d*)([%s])$" % ''.join(_SIZE_MULTIPLIERS))
+# Upper bound, in seconds, for the backoff between access rules status polls
+_ACCESS_UPDATE_MAX_POLL_INTERVAL = 5.0
 
 synchronized = lockutils.synchronized_with_prefix('manila-')
 
@@ -61,58 +70,85 @@ synchronized = lockutils.synchronized_with_prefix('manila-')
 def isotime(at=None, subsecond=False):
     """Stringify time in ISO 8601 format."""
 
-    # Python provides a similar instance method for datetime.datetime objects
-    # called isoformat(). The format of the strings generated by isoformat()
-    # have a couple of problems:
-    # 1) The strings generated by isotime are used in tokens and other public
-    #    APIs that we can't change without a deprecation period. The strings
-    #    generated by isoformat are not the same format, so we can't just
-    #    change to it.
-    # 2) The strings generated by isoformat do not include the microseconds if
-    #    the value happens to be 0. This will likely show up as random failures
-    #    as parsers may be written to always expect microseconds, and it will
-    #    parse correctly most of the time.
+    # The strings generated by isotime are used in tokens and other public
+    # APIs that we can't change without a deprecation period. By default,
+    # isoformat() appends the UTC offset and omits the microseconds when they
+    # happen to be 0, so it is only used with an explicit timespec and on a
+    # naive datetime, and the timezone suffix is added below.
 
     if not at:
         at = timeutils.utcnow()
-    st = at.strftime(_ISO8601_TIME_FORMAT
-                     if not subsecond
-                     else _ISO8601_TIME_FORMAT_SUBSECOND)
-    tz = at.tzinfo.tzname(None) if at.tzinfo else 'UTC'
+    timespec = 'microseconds' if subsecond else 'seconds'
+    if at.tzinfo:
+        st = at.replace(tzinfo=None).isoformat(timespec=timespec)
+        tz = at.tzinfo.tzname(None)
+    else:
+        st = at.isoformat(timespec=timespec)
+        tz = 'UTC'
     # Need to handle either iso8601 or python UTC format
     st += ('Z' if tz in ['UTC', 'UTC+00:00'] else tz)
     return st
 
 
+# Values derived from the configuration on hot paths (every execute() call,
+# every notification) are computed on first use and reset whenever the
+# configuration is reloaded.
+_NOTIFICATIONS_ENABLED = None
+
+
+def _reset_conf_cache(conf, fresh):
+    global _NOTIFICATIONS_ENABLED
+    _get_root_helper.cache_clear()
+    _debug_enabled.cache_clear()
+    _NOTIFICATIONS_ENABLED = None
+
+
+CONF.register_mutate_hook(_reset_conf_cache)
+
+
+@functools.lru_cache(maxsize=1)
 def _get_root_helper():
     return 'sudo manila-rootwrap %s' % CONF.rootwrap_config
 
 
+@functools.lru_cache(maxsize=1)
+def _debug_enabled():
+    return getattr(CONF, 'debug', False)
+
+
 def execute(*cmd, **kwargs):
     """Convenience wrapper around oslo's execute() function."""
     kwargs.setdefault('root_helper', _get_root_helper())
-    if getattr(CONF, 'debug', False):
+    if _debug_enabled():
         kwargs['loglevel'] = logging.DEBUG
     return processutils.execute(*cmd, **kwargs)
 
 
 def check_ssh_injection(cmd_list):
-    ssh_injection_pattern = ['`', '$', '|', '||', ';', '&', '&&', '>', '>>',
-                             '<']
-
     # Check whether injection attacks exist
     for arg in cmd_list:
         arg = arg.strip()
 
-        # Check for matching quotes on the ends
-        is_quoted = re.match('^(?P<quote>[\'"])(?P<quoted>.*)(?P=quote)$', arg)
-        if is_quoted:
-            # Check for unescaped quotes within the quoted argument
-            quoted = is_quoted.group('quoted')
-            if quoted:
-                if (re.match('[\'"]', quoted) or
-                        re.search('[^\\\\][\'"]', quoted)):
-                    raise exception.SSHInjectionThreat(command=cmd_list)
+        # Most arguments contain neither quotes nor shell operators, so the
+        # only thing left to check for them is unquoted whitespace.
+        if _SSH_SPECIAL_CHARS.isdisjoint(arg):
+            if len(arg.split()) > 1:
+                raise exception.SSHInjectionThreat(command=cmd_list)
+            continue
+
+        # Check for matching quotes on the ends (a quoted argument spanning
+        # several lines is not treated as quoted)
+        if (len(arg) > 1 and arg[0] == arg[-1] and arg[0] in _QUOTES and
+                '\n' not in arg):
+            # Check for unescaped quotes of either kind within the quoted
+            # argument
+            quoted = arg[1:-1]
+            for quote in _QUOTES:
+                i = quoted.find(quote)
+                while i != -1:
+                    if i == 0 or quoted[i - 1] != '\\':
+                        raise exception.SSHInjectionThreat(command=cmd_list)
+                    i = quoted.find(quote, i + 1)
         else:
             # We only allow spaces within quoted arguments, and that
             # is the only special character allowed within quotes
@@ -121,14 +157,9 @@ def check_ssh_injection(cmd_list):
 
         # Second, check whether danger character in command. So the shell
         # special operator must be a single argument.
-        for c in ssh_injection_pattern:
-            if c not in arg:
-                continue
-
-            result = arg.find(c)
-            if not result == -1:
-                if result == 0 or not arg[result - 1] == '\\':
-                    raise exception.SSHInjectionThreat(command=cmd_list)
+        for i, ch in enumerate(arg):
+            if ch in _SHELL_META and (i == 0 or arg[i - 1] != '\\'):
+                raise exception.SSHInjectionThreat(command=cmd_list)
 
 
 class LazyPluggable(object):
@@ -159,7 +190,11 @@ class LazyPluggable(object):
 
     def __getattr__(self, key):
         backend = self.__get_backend()
-        return getattr(backend, key)
+        value = getattr(backend, key)
+        # Store the resolved attribute on the instance so that later lookups
+        # find it directly and no longer go through __getattr__.
+        setattr(self, key, value)
+        return value
 
 
 def monkey_patch():
@@ -189,25 +224,34 @@ def monkey_patch():
         # import decorator function
         decorator = importutils.import_class(decorator_name)
         __import__(module)
-        # Retrieve module information using pyclbr
-        module_data = pyclbr.readmodule_ex(module)
-        for key in module_data.keys():
-            # set the decorator for the class methods
-            if isinstance(module_data[key], pyclbr.Class):
-                clz = importutils.import_class("%s.%s" % (module, key))
-                # NOTE(vponomaryov): we need to distinguish class methods types
-                # for py2 and py3, because the concept of 'unbound methods' has
-                # been removed from the python3.x
-                member_type = inspect.isfunction
-                for method, func in inspect.getmembers(clz, member_type):
-                    setattr(
-                        clz, method,
-                        decorator("%s.%s.%s" % (module, key, method), func))
+        mod = sys.modules[module]
+        # Walk the already imported module instead of parsing its source.
+        # Only classes and functions defined in the module itself are
+        # patched, not the ones it imported from elsewhere, and each of them
+        # only once even if the module also binds it to an alias.
+        seen = set()
+        for key, obj in list(vars(mod).items()):
+            if (getattr(obj, '__module__', None) != module or
+                    id(obj) in seen):
+                continue
+            seen.add(id(obj))
+            # set the decorator for the class methods, including the ones
+            # inherited from base classes (the most derived one wins)
+            if inspect.isclass(obj):
+                members = {}
+                for clz in reversed(obj.__mro__[:-1]):
+                    members.update(vars(clz))
+                for method, func in members.items():
+                    name = "%s.%s.%s" % (module, key, method)
+                    if inspect.isfunction(func):
+                        setattr(obj, method, decorator(name, func))
+                    elif (isinstance(func, staticmethod) and
+                            inspect.isfunction(func.__func__)):
+                        setattr(obj, method,
+                                staticmethod(decorator(name, func.__func__)))
             # set the decorator for the function
-            if isinstance(module_data[key], pyclbr.Function):
-                func = importutils.import_class("%s.%s" % (module, key))
-                setattr(sys.modules[module], key,
-                        decorator("%s.%s" % (module, key), func))
+            elif inspect.isfunction(obj):
+                setattr(mod, key, decorator("%s.%s" % (module, key), obj))
 
 
 def file_open(*args, **kwargs):
@@ -222,11 +266,18 @@ def file_open(*args, **kwargs):
     return open(*args, **kwargs)
 
 
-def service_is_up(service):
-    """Check whether a service is up based on last heartbeat."""
+def service_is_up(service, now=None):
+    """Check whether a service is up based on last heartbeat.
+
+    :param service: the service to check
+    :param now: current UTC time; callers checking many services at once
+        can pass it in to avoid looking it up for every service
+    """
     last_heartbeat = service['updated_at'] or service['created_at']
+    if now is None:
+        now = timeutils.utcnow()
     # Timestamps in DB are UTC.
-    tdelta = timeutils.utcnow() - last_heartbeat
+    tdelta = now - last_heartbeat
     elapsed = tdelta.total_seconds()
     return abs(elapsed) <= CONF.service_down_time
 
@@ -254,11 +305,11 @@ def tempdir(**kwargs):
 
 def walk_class_hierarchy(clazz, encountered=None):
     """Walk class hierarchy, yielding most derived classes first."""
-    if not encountered:
-        encountered = []
+    if encountered is None:
+        encountered = set()
     for subclass in clazz.__subclasses__():
         if subclass not in encountered:
-            encountered.append(subclass)
+            encountered.add(subclass)
             # drill down to leaves first
             for subsubclass in walk_class_hierarchy(subclass, encountered):
                 yield subsubclass
@@ -274,35 +325,43 @@ def cidr_to_network(cidr):
         raise exception.InvalidInput(_("Invalid cidr supplied %s") % cidr)
 
 
+@functools.lru_cache(maxsize=512)
+def cidr_to_network_info(cidr):
+    """Convert cidr to a (netmask, prefix length) tuple.
+
+    The cidr is parsed only once for both values, and the results are
+    cached since drivers look up the same few share network cidrs over and
+    over. The network object itself is not cached because it is mutable.
+    """
+    network = cidr_to_network(cidr)
+    return str(network.netmask), network.prefixlen
+
+
 def cidr_to_netmask(cidr):
     """Convert cidr to netmask."""
-    return str(cidr_to_network(cidr).netmask)
+    return cidr_to_network_info(cidr)[0]
 
 
 def cidr_to_prefixlen(cidr):
     """Convert cidr to prefix length."""
-    return cidr_to_network(cidr).prefixlen
+    return cidr_to_network_info(cidr)[1]
 
 
 def is_valid_ip_address(ip_address, ip_version):
     ip_version = ([int(ip_version)] if not isinstance(ip_version, list)
                   else ip_version)
 
-    if not set(ip_version).issubset(set([4, 6])):
+    if not _IP_VERSIONS.issuperset(ip_version):
         raise exception.ManilaException(
             _("Provided improper IP version '%s'.") % ip_version)
 
     if not isinstance(ip_address, str):
         return False
 
-    if 4 in ip_version:
-        if netutils.is_valid_ipv4(ip_address):
-            return True
-    if 6 in ip_version:
-        if netutils.is_valid_ipv6(ip_address):
-            return True
-
-    return False
+    try:
+        return ipaddress.ip_address(ip_address).version in ip_version
+    except ValueError:
+        return False
 
 
 def get_bool_param(param_string, params, default=False):
@@ -342,31 +401,46 @@ class IsAMatcher(object):
 
 
 class ComparableMixin(object):
-    def _compare(self, other, method):
+    # The operators are spelled out rather than dispatched through a shared
+    # helper, to keep comparisons (e.g. when sorting) to a single frame.
+    # If _cmpkey is not implemented, or returns a different type, we can't
+    # compare with "other".
+
+    def __lt__(self, other):
         try:
-            return method(self._cmpkey(), other._cmpkey())
+            return self._cmpkey() < other._cmpkey()
         except (AttributeError, TypeError):
-            # _cmpkey not implemented, or return different type,
-            # so I can't compare with "other".
             return NotImplemented
 
-    def __lt__(self, other):
-        return self._compare(other, lambda s, o: s < o)
-
     def __le__(self, other):
-        return self._compare(other, lambda s, o: s <= o)
+        try:
+            return self._cmpkey() <= other._cmpkey()
+        except (AttributeError, TypeError):
+            return NotImplemented
 
     def __eq__(self, other):
-        return self._compare(other, lambda s, o: s == o)
+        try:
+            return self._cmpkey() == other._cmpkey()
+        except (AttributeError, TypeError):
+            return NotImplemented
 
     def __ge__(self, other):
-        return self._compare(other, lambda s, o: s >= o)
+        try:
+            return self._cmpkey() >= other._cmpkey()
+        except (AttributeError, TypeError):
+            return NotImplemented
 
     def __gt__(self, other):
-        return self._compare(other, lambda s, o: s > o)
+        try:
+            return self._cmpkey() > other._cmpkey()
+        except (AttributeError, TypeError):
+            return NotImplemented
 
     def __ne__(self, other):
-        return self._compare(other, lambda s, o: s != o)
+        try:
+            return self._cmpkey() != other._cmpkey()
+        except (AttributeError, TypeError):
+            return NotImplemented
 
 
 class retry_if_exit_code(tenacity.retry_if_exception):
@@ -410,18 +484,23 @@ def retry(retry_param=Exception,
         stop = tenacity.stop_after_attempt(retries)
 
     def _decorator(f):
+        retrying = tenacity.Retrying(
+            sleep=tenacity.nap.sleep,
+            before_sleep=tenacity.before_sleep_log(LOG, logging.DEBUG),
+            after=tenacity.after_log(LOG, logging.DEBUG),
+            stop=stop,
+            reraise=True,
+            retry=retry(retry_param),
+            wait=wait)
 
         @functools.wraps(f)
         def _wrapper(*args, **kwargs):
-            r = tenacity.Retrying(
-                sleep=tenacity.nap.sleep,
-                before_sleep=tenacity.before_sleep_log(LOG, logging.DEBUG),
-                after=tenacity.after_log(LOG, logging.DEBUG),
-                stop=stop,
-                reraise=True,
-                retry=retry(retry_param),
-                wait=wait)
-            return r(f, *args, **kwargs)
+            # Retrying keeps the state of a run on the instance, so use a
+            # copy per call to stay safe for nested and concurrent calls.
+            # The sleep function is looked up at call time so that it can
+            # still be patched for functions decorated at import time.
+            return retrying.copy(sleep=tenacity.nap.sleep)(
+                f, *args, **kwargs)
 
         return _wrapper
 
@@ -454,7 +533,7 @@ def check_params_exist(keys, params):
     :param keys: List of keys to check
     :param params: Parameters received from REST API
     """
-    if any(set(keys) - set(params)):
+    if any(key not in params for key in keys):
         msg = _("Must specify all mandatory parameters: %s") % keys
         raise exc.HTTPBadRequest(explanation=msg)
 
@@ -514,30 +593,25 @@ def translate_string_size_to_float(string, multiplier='G'):
     """
     if not isinstance(string, str):
         return None
-    multipliers = ('K', 'M', 'G', 'T', 'P')
-    mapping = {
-        k: 1024.0 ** v
-        for k, v in zip(multipliers, range(len(multipliers)))
-    }
-    if multiplier not in multipliers:
+    if multiplier not in _SIZE_MULTIPLIERS:
         raise exception.ManilaException(
             "'multiplier' arg should be one of following: "
             "'%(multipliers)s'. But it is '%(multiplier)s'." % {
                 'multiplier': multiplier,
-                'multipliers': "', '".join(multipliers),
+                'multipliers': "', '".join(_SIZE_MULTIPLIERS),
             }
         )
     try:
         value = float(string.replace(",", ".")) / 1024.0
-        value = value / mapping[multiplier]
+        value = value / _SIZE_MULTIPLIER_MAP[multiplier]
         return value
     except (ValueError, TypeError):
-        matched = re.match(
-            r"^(\d*[.,]*\d*)([%s])$" % ''.join(multipliers), string)
+        matched = _SIZE_RE.match(string)
         if matched:
             # The replace() is needed in case decimal separator is a comma
             value = float(matched.groups()[0].replace(",", "."))
-            multiplier = mapping[matched.groups()[1]] / mapping[multiplier]
+            multiplier = (_SIZE_MULTIPLIER_MAP[matched.groups()[1]] /
+                          _SIZE_MULTIPLIER_MAP[multiplier])
             return value * multiplier
 
 
@@ -568,8 +642,11 @@ def wait_for_access_update(context, db, share_instance,
                 'timeout': migration_wait_access_rules_timeout}
             raise exception.ShareMigrationFailed(reason=msg)
         else:
-            # 1.414 = square-root of 2
-            time.sleep(1.414 ** tries)
+            # 1.414 = square-root of 2. Cap the backoff so a rule that becomes
+            # active between polls is noticed quickly, and never sleep past
+            # the deadline.
+            time.sleep(min(1.414 ** tries, _ACCESS_UPDATE_MAX_POLL_INTERVAL,
+                           deadline - now))
 
 
 class DoNothing(str):
@@ -578,6 +655,10 @@ class DoNothing(str):
     We inherit from str in case it's called with json.dumps.
     """
 
+    # No per-instance __dict__ is needed, attribute lookups never store
+    # anything on the object.
+    __slots__ = ()
+
     def __call__(self, *args, **kwargs):
         return self
 
@@ -590,8 +671,15 @@ DO_NOTHING = DoNothing()
 
 def notifications_enabled(conf):
     """Check if oslo notifications are enabled."""
+    global _NOTIFICATIONS_ENABLED
+    # Only the answer for the global config is cached
+    if conf is CONF and _NOTIFICATIONS_ENABLED is not None:
+        return _NOTIFICATIONS_ENABLED
     notifications_driver = set(conf.oslo_messaging_notifications.driver)
-    return notifications_driver and notifications_driver != {'noop'}
+    enabled = bool(notifications_driver and notifications_driver != {'noop'})
+    if conf is CONF:
+        _NOTIFICATIONS_ENABLED = enabled
+    return enabled
 
 
 def if_notifications_enabled(function):
@@ -606,14 +694,14 @@ def if_notifications_enabled(function):
 
 def write_remote_file(ssh, filename, contents, as_root=False):
     tmp_filename = "%s.tmp" % filename
+    # Write the temporary file and move it in place with a single command,
+    # so only one ssh channel has to be opened.
+    script = 'cat > %(tmp)s && mv -f %(tmp)s %(file)s' % {
+        'tmp': shlex.quote(tmp_filename), 'file': shlex.quote(filename)}
+    cmd = 'sh -c %s' % shlex.quote(script)
     if as_root:
-        cmd = 'sudo tee "%s" > /dev/null' % tmp_filename
-        cmd2 = 'sudo mv -f "%s" "%s"' % (tmp_filename, filename)
-    else:
-        cmd = 'cat > "%s"' % tmp_filename
-        cmd2 = 'mv -f "%s" "%s"' % (tmp_filename, filename)
+        cmd = 'sudo ' + cmd
     stdin, __, __ = ssh.exec_command(cmd)
     stdin.write(contents)
     stdin.close()
     stdin.channel.shutdown_write()
-    ssh.exec_command(cmd2)